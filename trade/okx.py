@@ -1,34 +1,67 @@
 import os
+import sys
 import time
-import schedule
-from openai import OpenAI
-import ccxt
+import queue
+import logging
+import asyncio
+from openai import AsyncOpenAI
+import ccxt.pro as ccxt
+from aiolimiter import AsyncLimiter
+import httpx
 import pandas as pd
+import numpy as np
+import bottleneck as bn
 from datetime import datetime
-import json
-import re
+import orjson
+import itertools
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from types import MappingProxyType
 from dotenv import load_dotenv
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+try:
+    import uvloop
+except ImportError:  # uvloop不支持Windows，使用默认事件循环
+    uvloop = None
 
 load_dotenv()
 
+logger = logging.getLogger('okx_bot')
+
 # 代理服务器配置
 PROXY_CONFIG = {
     'http': os.getenv('HTTP_PROXY', 'http://127.0.0.1:7897'),
     'https': os.getenv('HTTPS_PROXY', 'http://127.0.0.1:7897'),
 }
 
+# 按OKX接口分组的令牌桶（每2秒请求数），同组接口共用额度，取组内接口文档限额的最小值；
+# 限额明显低于所在组的接口单独设桶：设置持仓模式5次/2秒，获取系统时间10次/2秒
+_BUCKETS = {
+    'market': AsyncLimiter(20, 2),
+    'account': AsyncLimiter(10, 2),
+    'trade': AsyncLimiter(20, 2),
+    'position_mode': AsyncLimiter(5, 2),
+    'public_time': AsyncLimiter(10, 2),
+}
+
+
+async def limited(bucket, coro):
+    """在指定限速桶内执行请求，用于并发请求"""
+    async with _BUCKETS[bucket]:
+        return await coro
+
 
 # 初始化DeepSeek客户端
 def setup_deepseek_client():
     """设置带代理的DeepSeek客户端"""
     try:
-        client = OpenAI(
+        client = AsyncOpenAI(
             api_key=os.getenv('DEEPSEEK_API_KEY'),
             base_url="https://api.deepseek.com",
-            http_client=None
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_keepalive_connections=5, max_connections=10),
+                timeout=30
+            )
         )
 
         if PROXY_CONFIG['http'] and PROXY_CONFIG['http'] != 'http://your_proxy_server:port':
@@ -36,16 +69,17 @@ def setup_deepseek_client():
         if PROXY_CONFIG['https'] and PROXY_CONFIG['https'] != 'http://your_proxy_server:port':
             os.environ['HTTPS_PROXY'] = PROXY_CONFIG['https']
 
-        print("✅ DeepSeek客户端代理设置完成")
+        logger.info("✅ DeepSeek客户端代理设置完成")
         return client
     except Exception as e:
-        print(f"❌ DeepSeek客户端初始化失败: {e}")
+        logger.error("❌ DeepSeek客户端初始化失败: %s", e)
         return None
 
 
 # 初始化OKX交易所
-def setup_okx_exchange():
+async def setup_okx_exchange():
     """设置带代理的OKX交易所"""
+    exchange = None
     try:
         exchange_config = {
             'options': {
@@ -54,32 +88,36 @@ def setup_okx_exchange():
             'apiKey': os.getenv('OKX_API_KEY'),
             'secret': os.getenv('OKX_SECRET'),
             'password': os.getenv('OKX_PASSWORD'),
-            'enableRateLimit': True,
+            # 由_BUCKETS按接口分组限速，CCXT内置限速器会将并发请求串行化
+            'enableRateLimit': False,
             'timeout': 30000
         }
 
         if (PROXY_CONFIG['http'] and PROXY_CONFIG['http'] != 'http://your_proxy_server:port' and
                 PROXY_CONFIG['https'] and PROXY_CONFIG['https'] != 'http://your_proxy_server:port'):
-            exchange_config['proxies'] = {
-                'http': PROXY_CONFIG['http'],
-                'https': PROXY_CONFIG['https'],
-            }
-            print("✅ CCXT代理设置完成")
+            # 异步版CCXT使用aiohttp，不支持requests风格的proxies字典
+            exchange_config['httpsProxy'] = PROXY_CONFIG['https']
+            exchange_config['wssProxy'] = PROXY_CONFIG['https']
+            logger.info("✅ CCXT代理设置完成")
         else:
-            print("⚠️ 使用直接连接，代理配置无效")
+            logger.warning("⚠️ 使用直接连接，代理配置无效")
 
+        # 异步版CCXT每个交易所实例自带一个长连接复用的aiohttp会话，并按verify/cafile配置证书校验
         exchange = ccxt.okx(exchange_config)
-        exchange.publicGetPublicTime()
-        print("✅ OKX交易所连接测试通过")
+        async with _BUCKETS['public_time']:
+            await exchange.publicGetPublicTime()
+        logger.info("✅ OKX交易所连接测试通过")
         return exchange
     except Exception as e:
-        print(f"❌ OKX交易所初始化失败: {e}")
+        logger.error("❌ OKX交易所初始化失败: %s", e)
+        if exchange is not None:
+            await exchange.close()
         return None
 
 
-# 初始化客户端和交易所
-deepseek_client = setup_deepseek_client()
-exchange = setup_okx_exchange()
+# 初始化客户端，交易所需要事件循环，且初始化日志需在日志配置之后输出，均在run_bot()中初始化
+deepseek_client = None
+exchange = None
 
 # 交易参数配置 - 针对10美元本金优化
 TRADE_CONFIG = {
@@ -90,34 +128,92 @@ TRADE_CONFIG = {
     'test_mode': False,
     'data_points': 96,
     'max_position_value': 100.0,
+    # 震荡且RSI中性、涨跌幅很小时跳过DeepSeek调用，直接观望
+    'skip_ai_rsi_low': float(os.getenv('SKIP_AI_RSI_LOW', '40')),
+    'skip_ai_rsi_high': float(os.getenv('SKIP_AI_RSI_HIGH', '60')),
+    'skip_ai_max_change': float(os.getenv('SKIP_AI_MAX_CHANGE', '0.3')),
 }
 
+# DeepSeek系统提示词，内容固定以便命中前缀缓存；用户消息只传特征值
+SIGNAL_SYSTEM_PROMPT = (
+    f"你是OKB/USDT {TRADE_CONFIG['timeframe']}周期交易信号引擎。"
+    "输入格式: 价格,涨跌幅%,RSI,趋势。"
+    '只输出严格JSON: {"signal":"BUY|SELL|HOLD","reason":"不超过30字的中文理由",'
+    '"stop_loss":价格,"take_profit":价格,"confidence":"HIGH|MEDIUM|LOW"}'
+)
+# 用户消息模板在加载时绑定，格式与系统提示词中的输入格式一致
+_PROMPT_TMPL = "{price:.2f},{chg:+.2f},{rsi:.1f},{trend}".format
+
 # 全局变量
-price_history = []
-signal_history = []
+signal_history = deque(maxlen=30)
 position = None
 
+# 合约规格缓存: inst_id -> (获取时间, 规格)，运行期间规格基本不变
+_CONTRACT_SPEC_CACHE = {}
+CONTRACT_SPEC_TTL = 3600
+
+# OKX批量撤单接口单次最多20个订单
+CANCEL_BATCH_SIZE = 20
+
+# 所有订单共用的固定参数，下单时展开后补充方向和数量
+_BASE_ORDER = MappingProxyType({
+    'instId': 'OKB-USDT-SWAP',
+    'tdMode': 'isolated',
+    'ordType': 'market',
+})
+
+# K线及技术指标状态，热启动时只拉取最新几根K线增量更新
+df_state = None
+INCREMENTAL_FETCH_BARS = 3
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# WebSocket推送的K线和持仓，ready为False时回退到REST查询
+ws_state = {
+    'bars': {},
+    'candles_ready': False,
+    'positions': {},
+    'positions_ready': False,
+    'positions_updated': asyncio.Event(),
+}
+WS_RECONNECT_DELAY = 5
+
+# 平仓后等待持仓归零的最长时间和REST轮询间隔（秒）
+FLAT_WAIT_TIMEOUT = 5
+FLAT_POLL_INTERVAL = 0.3
+
+# 持仓查询结果短时缓存: (查询时间, 持仓)，避免同一周期内重复请求；-inf表示无缓存
+_POS_CACHE = (float('-inf'), None)
+POSITION_CACHE_TTL = 2
+
+
+async def get_contract_specs(inst_id='OKB-USDT-SWAP'):
+    """获取合约规格信息（带缓存）"""
+    cached = _CONTRACT_SPEC_CACHE.get(inst_id)
+    if cached and time.time() - cached[0] < CONTRACT_SPEC_TTL:
+        return cached[1]
 
-def get_contract_specs(inst_id='OKB-USDT-SWAP'):
-    """获取合约规格信息"""
     try:
-        print(f"📋 获取合约规格信息: {inst_id}")
-        instruments = exchange.publicGetPublicInstruments({
-            'instType': 'SWAP',
-            'instId': inst_id
-        })
+        logger.debug("📋 获取合约规格信息: %s", inst_id)
+        async with _BUCKETS['market']:
+            instruments = await exchange.publicGetPublicInstruments({
+                'instType': 'SWAP',
+                'instId': inst_id
+            })
 
         if instruments and instruments.get('code') == '0':
             data = instruments.get('data', [])
             if data:
                 spec = data[0]
-                return {
+                contract_spec = {
                     'min_size': float(spec.get('minSz', '0.01')),
                     'size_increment': float(spec.get('lotSz', '0.0001')),
                     'contract_value': float(spec.get('ctVal', '0.1')),
                 }
+                # 只缓存成功获取的规格，失败时下次重新请求
+                _CONTRACT_SPEC_CACHE[inst_id] = (time.time(), contract_spec)
+                return contract_spec
     except Exception as e:
-        print(f"⚠️ 获取合约规格失败: {e}")
+        logger.warning("⚠️ 获取合约规格失败: %s", e)
 
     return {
         'min_size': 0.01,
@@ -126,10 +222,10 @@ def get_contract_specs(inst_id='OKB-USDT-SWAP'):
     }
 
 
-def calculate_position_size(price, target_notional=5.0):
+async def calculate_position_size(price, target_notional=5.0):
     """根据目标价值和价格计算仓位大小"""
     try:
-        contract_spec = get_contract_specs('OKB-USDT-SWAP')
+        contract_spec = await get_contract_specs('OKB-USDT-SWAP')
         contract_value = contract_spec['contract_value']
 
         # 计算需要的合约张数：目标价值 / (合约面值 * 价格)
@@ -150,14 +246,14 @@ def calculate_position_size(price, target_notional=5.0):
         actual_notional = adjusted_contracts * contract_value * price
         required_margin = actual_notional / TRADE_CONFIG['leverage']
 
-        print(f"🎯 仓位计算: 目标{target_notional}USD, 价格${price:.2f}")
-        print(f"📊 合约面值: {contract_value}OKB, 需要{adjusted_contracts:.4f}张合约")
-        print(f"💰 实际开仓价值: ${actual_notional:.2f}, 所需保证金: ${required_margin:.4f}")
+        logger.info("🎯 仓位计算: 目标%sUSD, 价格$%.2f", target_notional, price)
+        logger.info("📊 合约面值: %sOKB, 需要%.4f张合约", contract_value, adjusted_contracts)
+        logger.info("💰 实际开仓价值: $%.2f, 所需保证金: $%.4f", actual_notional, required_margin)
 
         return adjusted_contracts, actual_notional, required_margin
 
     except Exception as e:
-        print(f"❌ 仓位计算失败: {e}")
+        logger.error("❌ 仓位计算失败: %s", e)
         # 返回默认值
         default_contracts = 0.01
         default_notional = default_contracts * 0.1 * price
@@ -165,26 +261,35 @@ def calculate_position_size(price, target_notional=5.0):
         return default_contracts, default_notional, default_margin
 
 
-def get_usdt_balance():
+async def get_usdt_balance():
     """获取USDT余额"""
     try:
+        # 资金账户和交易账户余额并发查询，仍优先使用资金账户
+        funding_balance, account_balance = await asyncio.gather(
+            limited('account', exchange.privateGetAssetBalances({'ccy': 'USDT'})),
+            limited('account', exchange.privateGetAccountBalance()),
+            return_exceptions=True
+        )
+
         # 方法1: 使用资金账户API
         try:
-            funding_balance = exchange.privateGetAssetBalances({'ccy': 'USDT'})
+            if isinstance(funding_balance, Exception):
+                raise funding_balance
             if funding_balance and funding_balance.get('code') == '0':
                 data = funding_balance.get('data', [])
                 for item in data:
                     if item.get('ccy') == 'USDT':
                         bal = float(item.get('bal', 0))
                         if bal > 0:
-                            print(f"✅ 资金账户余额: {bal:.2f} USDT")
+                            logger.info("✅ 资金账户余额: %.2f USDT", bal)
                             return bal
         except Exception as e:
-            print(f"⚠️ 资金账户查询失败: {e}")
+            logger.warning("⚠️ 资金账户查询失败: %s", e)
 
         # 方法2: 使用账户余额API
         try:
-            account_balance = exchange.privateGetAccountBalance()
+            if isinstance(account_balance, Exception):
+                raise account_balance
             if account_balance and account_balance.get('code') == '0':
                 data = account_balance.get('data', [])
                 if data:
@@ -193,91 +298,184 @@ def get_usdt_balance():
                         if detail.get('ccy') == 'USDT':
                             avail_bal = float(detail.get('availBal', 0))
                             if avail_bal > 0:
-                                print(f"✅ 可用余额: {avail_bal:.2f} USDT")
+                                logger.info("✅ 可用余额: %.2f USDT", avail_bal)
                                 return avail_bal
         except Exception as e:
-            print(f"⚠️ 账户余额查询失败: {e}")
+            logger.warning("⚠️ 账户余额查询失败: %s", e)
 
-        print("⚠️ 使用默认余额10 USDT")
+        logger.warning("⚠️ 使用默认余额10 USDT")
         return 10.0
 
     except Exception as e:
-        print(f"❌ 余额查询失败: {e}")
+        logger.error("❌ 余额查询失败: %s", e)
         return 10.0
 
 
-def get_current_position():
-    """获取当前持仓情况 - 修复版本"""
-    try:
-        print("📦 查询当前持仓...")
-        positions_response = exchange.privateGetAccountPositions({'instType': 'SWAP'})
+async def get_current_position():
+    """获取当前持仓情况，REST查询时短时间内的重复调用复用上次结果"""
+    global _POS_CACHE
+    # 推送持仓已在内存中且始终最新，无需缓存
+    if ws_state['positions_ready']:
+        return await query_current_position()
 
-        if positions_response.get('code') == '0':
-            positions_data = positions_response.get('data', [])
-            for pos in positions_data:
-                if pos.get('instId') == 'OKB-USDT-SWAP':
-                    contracts = float(pos.get('pos', 0))
-                    # 更严格的持仓检查：持仓数量必须大于最小交易量
-                    min_size = get_contract_specs().get('min_size', 0.001)
-                    if abs(contracts) > min_size:
-                        position_info = {
-                            'side': 'long' if contracts > 0 else 'short',
-                            'size': abs(contracts),
-                            'entry_price': float(pos.get('avgPx', 0)),
-                            'unrealized_pnl': float(pos.get('upl', 0)),
-                            'leverage': float(pos.get('lever', TRADE_CONFIG['leverage'])),
-                            'state': pos.get('state', 'live')  # 添加持仓状态
-                        }
+    cached_at, cached_position = _POS_CACHE
+    if time.monotonic() - cached_at < POSITION_CACHE_TTL:
+        return cached_position
 
-                        # 检查持仓状态是否有效
-                        if position_info['state'] in ['live', 'normal']:
-                            print(f"✅ 当前持仓: {position_info}")
-                            return position_info
-                        else:
-                            print(f"⚠️ 持仓状态无效: {position_info['state']}")
-                            return None
+    position_info = await query_current_position()
+    _POS_CACHE = (time.monotonic(), position_info)
+    return position_info
+
+
+def invalidate_position_cache():
+    """下单后清除持仓缓存，确保下次查询拿到最新持仓"""
+    global _POS_CACHE
+    _POS_CACHE = (float('-inf'), None)
+
+
+async def query_current_position():
+    """查询当前持仓情况 - 修复版本，优先使用WebSocket推送的持仓"""
+    try:
+        if ws_state['positions_ready']:
+            positions_data = list(ws_state['positions'].values())
+        else:
+            logger.debug("📦 查询当前持仓...")
+            async with _BUCKETS['account']:
+                positions_response = await exchange.privateGetAccountPositions({'instType': 'SWAP'})
+            positions_data = positions_response.get('data', []) if positions_response.get('code') == '0' else []
+
+        for pos in positions_data:
+            if pos.get('instId') == 'OKB-USDT-SWAP':
+                contracts = float(pos.get('pos', 0))
+                # 更严格的持仓检查：持仓数量必须大于最小交易量
+                min_size = (await get_contract_specs()).get('min_size', 0.001)
+                if abs(contracts) > min_size:
+                    position_info = {
+                        'side': 'long' if contracts > 0 else 'short',
+                        'size': abs(contracts),
+                        'entry_price': float(pos.get('avgPx', 0)),
+                        'unrealized_pnl': float(pos.get('upl', 0)),
+                        'leverage': float(pos.get('lever', TRADE_CONFIG['leverage'])),
+                        'state': pos.get('state', 'live')  # 添加持仓状态
+                    }
+
+                    # 检查持仓状态是否有效
+                    if position_info['state'] in ['live', 'normal']:
+                        logger.info("✅ 当前持仓: %s", position_info)
+                        return position_info
                     else:
-                        print(f"⚠️ 持仓数量过小: {contracts}, 最小要求: {min_size}")
+                        logger.warning("⚠️ 持仓状态无效: %s", position_info['state'])
+                        return None
+                else:
+                    logger.warning("⚠️ 持仓数量过小: %s, 最小要求: %s", contracts, min_size)
 
-        print("📦 当前无有效持仓")
+        logger.info("📦 当前无有效持仓")
         return None
     except Exception as e:
-        print(f"❌ 获取持仓失败: {e}")
+        logger.error("❌ 获取持仓失败: %s", e)
+        return None
+
+
+async def watch_ohlcv_loop():
+    """订阅K线推送，维护最近的K线缓存"""
+    while True:
+        try:
+            candles = await exchange.watch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'])
+            bars = ws_state['bars']
+            for candle in candles:
+                bars[candle[0]] = list(candle[:6])
+            # 只保留最近的K线
+            for ts in sorted(bars)[:-TRADE_CONFIG['data_points']]:
+                del bars[ts]
+            ws_state['candles_ready'] = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ws_state['candles_ready'] = False
+            logger.warning("⚠️ K线推送中断，%s秒后重连: %s", WS_RECONNECT_DELAY, e)
+            await asyncio.sleep(WS_RECONNECT_DELAY)
+
+
+async def watch_positions_loop():
+    """订阅持仓推送，维护最新的原始持仓数据"""
+    while True:
+        try:
+            positions = await exchange.watch_positions([TRADE_CONFIG['symbol']])
+            for pos in positions:
+                info = pos.get('info') or {}
+                if info.get('instId'):
+                    key = (info['instId'], info.get('posSide'))
+                    # 平仓后会推送数量为0的持仓，直接移除
+                    if float(info.get('pos') or 0) == 0:
+                        ws_state['positions'].pop(key, None)
+                    else:
+                        ws_state['positions'][key] = info
+            ws_state['positions_ready'] = True
+            ws_state['positions_updated'].set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 重连后会收到新的持仓快照，丢弃旧数据避免残留已平仓的持仓
+            ws_state['positions_ready'] = False
+            ws_state['positions'].clear()
+            logger.warning("⚠️ 持仓推送中断，%s秒后重连: %s", WS_RECONNECT_DELAY, e)
+            await asyncio.sleep(WS_RECONNECT_DELAY)
+
+
+def get_ws_ohlcv():
+    """返回WebSocket缓存的K线，推送中断或数据过期时返回None"""
+    bars = ws_state['bars']
+    if not ws_state['candles_ready'] or not bars:
+        return None
+    # 最新K线超过两个周期未更新，视为推送失效
+    period_ms = exchange.parse_timeframe(TRADE_CONFIG['timeframe']) * 1000
+    if time.time() * 1000 - max(bars) > 2 * period_ms:
         return None
+    return [bars[ts] for ts in sorted(bars)]
 
 
-def cancel_all_open_orders():
+async def cancel_all_open_orders():
     """取消所有未成交订单"""
     try:
-        print("🗑️ 取消所有未成交订单...")
+        logger.info("🗑️ 取消所有未成交订单...")
 
         # 获取当前所有未成交订单
-        open_orders = exchange.fetch_open_orders(symbol='OKB/USDT:USDT')
+        async with _BUCKETS['trade']:
+            open_orders = await exchange.fetch_open_orders(symbol='OKB/USDT:USDT')
         if open_orders:
-            print(f"📋 发现 {len(open_orders)} 个未成交订单")
+            logger.info("📋 发现 %s 个未成交订单", len(open_orders))
 
-            for order in open_orders:
+            # 使用批量撤单接口，每次最多撤销20个订单
+            cancel_requests = iter([{'instId': 'OKB-USDT-SWAP', 'ordId': order['id']} for order in open_orders])
+            while True:
+                batch = list(itertools.islice(cancel_requests, CANCEL_BATCH_SIZE))
+                if not batch:
+                    break
                 try:
-                    cancel_response = exchange.cancel_order(order['id'], symbol='OKB/USDT:USDT')
-                    if cancel_response:
-                        print(f"✅ 已取消订单: {order['id']}")
-                    time.sleep(0.5)  # 避免频率限制
+                    async with _BUCKETS['trade']:
+                        cancel_response = await exchange.privatePostTradeCancelBatchOrders(batch)
+                    for result in cancel_response.get('data', []):
+                        if result.get('sCode') == '0':
+                            logger.info("✅ 已取消订单: %s", result.get('ordId'))
+                        else:
+                            logger.warning("⚠️ 取消订单 %s 失败: %s", result.get('ordId'), result.get('sMsg'))
                 except Exception as e:
-                    print(f"⚠️ 取消订单 {order['id']} 失败: {e}")
+                    logger.warning("⚠️ 批量取消订单失败: %s", e)
         else:
-            print("✅ 没有未成交订单需要取消")
+            logger.info("✅ 没有未成交订单需要取消")
 
     except Exception as e:
-        print(f"❌ 取消订单操作失败: {e}")
+        logger.error("❌ 取消订单操作失败: %s", e)
 
 
-def close_all_positions():
+async def close_all_positions():
     """平掉所有持仓 - 修复版本"""
     try:
-        print("📦 检查并平掉所有持仓...")
+        logger.info("📦 检查并平掉所有持仓...")
 
         # 获取当前持仓
-        positions_response = exchange.privateGetAccountPositions({'instType': 'SWAP'})
+        async with _BUCKETS['account']:
+            positions_response = await exchange.privateGetAccountPositions({'instType': 'SWAP'})
 
         if positions_response.get('code') == '0':
             positions_data = positions_response.get('data', [])
@@ -287,7 +485,7 @@ def close_all_positions():
                 if pos.get('instId') == 'OKB-USDT-SWAP':
                     contracts = float(pos.get('pos', 0))
                     # 更严格的持仓检查
-                    min_size = get_contract_specs().get('min_size', 0.001)
+                    min_size = (await get_contract_specs()).get('min_size', 0.001)
                     if abs(contracts) > min_size:
                         positions_to_close.append({
                             'instId': pos.get('instId'),
@@ -298,185 +496,218 @@ def close_all_positions():
                         })
 
             if positions_to_close:
-                print(f"📦 发现 {len(positions_to_close)} 个持仓需要平仓")
+                logger.info("📦 发现 %s 个持仓需要平仓", len(positions_to_close))
 
                 for position in positions_to_close:
                     try:
                         # 检查持仓状态是否有效
                         if position['state'] not in ['live', 'normal']:
-                            print(f"⚠️ 持仓状态无效，跳过平仓: {position}")
+                            logger.warning("⚠️ 持仓状态无效，跳过平仓: %s", position)
                             continue
 
                         # 平仓操作 - 修复参数
                         close_params = {
+                            **_BASE_ORDER,
                             'instId': position['instId'],
-                            'tdMode': 'isolated',
                             'side': 'buy' if position['side'] == 'short' else 'sell',
                             'posSide': position['posSide'],
-                            'ordType': 'market',
                             'sz': str(position['size']),
                             'reduceOnly': True  # 添加只减仓标志
                         }
 
-                        print(f"🔄 平仓参数: {close_params}")
+                        logger.debug("🔄 平仓参数: %s", close_params)
 
-                        close_response = exchange.privatePostTradeOrder(close_params)
+                        async with _BUCKETS['trade']:
+                            close_response = await exchange.privatePostTradeOrder(close_params)
                         if close_response.get('code') == '0':
-                            print(f"✅ 已平仓: {position['instId']} {position['side']} {position['size']}")
+                            logger.info("✅ 已平仓: %s %s %s", position['instId'], position['side'], position['size'])
                         else:
-                            print(f"⚠️ 平仓失败: {close_response}")
+                            logger.warning("⚠️ 平仓失败: %s", close_response)
                             # 如果平仓失败，尝试使用CCXT标准方法
                             try:
-                                print("🔄 尝试使用CCXT标准方法平仓...")
+                                logger.info("🔄 尝试使用CCXT标准方法平仓...")
                                 if position['side'] == 'long':
                                     # 平多仓
-                                    exchange.create_order(
-                                        symbol='OKB/USDT:USDT',
-                                        type='market',
-                                        side='sell',
-                                        amount=position['size'],
-                                        params={'reduceOnly': True}
-                                    )
+                                    async with _BUCKETS['trade']:
+                                        await exchange.create_order(
+                                            symbol='OKB/USDT:USDT',
+                                            type='market',
+                                            side='sell',
+                                            amount=position['size'],
+                                            params={'reduceOnly': True}
+                                        )
                                 else:
                                     # 平空仓
-                                    exchange.create_order(
-                                        symbol='OKB/USDT:USDT',
-                                        type='market',
-                                        side='buy',
-                                        amount=position['size'],
-                                        params={'reduceOnly': True}
-                                    )
-                                print("✅ CCXT标准平仓成功")
+                                    async with _BUCKETS['trade']:
+                                        await exchange.create_order(
+                                            symbol='OKB/USDT:USDT',
+                                            type='market',
+                                            side='buy',
+                                            amount=position['size'],
+                                            params={'reduceOnly': True}
+                                        )
+                                logger.info("✅ CCXT标准平仓成功")
                             except Exception as e2:
-                                print(f"❌ CCXT标准平仓也失败: {e2}")
-
-                        time.sleep(1)  # 避免频率限制
+                                logger.error("❌ CCXT标准平仓也失败: %s", e2)
                     except Exception as e:
-                        print(f"❌ 平仓操作失败: {e}")
+                        logger.error("❌ 平仓操作失败: %s", e)
+                invalidate_position_cache()
             else:
-                print("✅ 没有持仓需要平仓")
+                logger.info("✅ 没有持仓需要平仓")
 
     except Exception as e:
-        print(f"❌ 平仓操作失败: {e}")
+        logger.error("❌ 平仓操作失败: %s", e)
+
+
+async def wait_until_flat(timeout=FLAT_WAIT_TIMEOUT):
+    """等待持仓归零，超时返回最后一次查询到的持仓，已平仓时返回None"""
+    deadline = time.monotonic() + timeout
+    while True:
+        # 先清除事件再查询，避免查询期间到达的推送被漏掉
+        ws_state['positions_updated'].clear()
+        invalidate_position_cache()
+        current_position = await get_current_position()
+        remaining = deadline - time.monotonic()
+        if current_position is None or remaining <= 0:
+            return current_position
+
+        if ws_state['positions_ready']:
+            # 推送可用时等待下一次持仓推送，而非固定轮询
+            try:
+                await asyncio.wait_for(ws_state['positions_updated'].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(FLAT_POLL_INTERVAL, remaining))
 
 
-def cleanup_before_setup():
+async def cleanup_before_setup():
     """在设置持仓模式前清理所有订单和持仓"""
     try:
-        print("🔄 开始清理现有订单和持仓...")
+        logger.info("🔄 开始清理现有订单和持仓...")
 
-        # 取消所有未成交订单
-        cancel_all_open_orders()
-        time.sleep(2)  # 等待订单取消完成
+        # 取消所有未成交订单，批量撤单接口已返回每个订单的撤单结果
+        await cancel_all_open_orders()
 
-        # 平掉所有持仓
-        close_all_positions()
-        time.sleep(3)  # 等待平仓完成
+        # 撤单后再查询持仓并平仓，撤单前刚成交的订单也会被平掉
+        await close_all_positions()
 
-        # 再次检查持仓状态
-        time.sleep(2)
-        current_position = get_current_position()
+        # 持仓一旦归零立即继续，最多等待FLAT_WAIT_TIMEOUT秒
+        current_position = await wait_until_flat()
         if current_position is None:
-            print("✅ 确认所有持仓已平仓")
+            logger.info("✅ 确认所有持仓已平仓")
         else:
-            print(f"⚠️ 仍有持仓存在: {current_position}")
+            logger.warning("⚠️ 仍有持仓存在: %s", current_position)
 
-        print("✅ 清理操作完成")
+        logger.info("✅ 清理操作完成")
         return True
     except Exception as e:
-        print(f"❌ 清理操作失败: {e}")
+        logger.error("❌ 清理操作失败: %s", e)
         return False
 
 
-def setup_exchange():
+async def setup_exchange():
     """设置交易所参数 - 修复版本"""
     try:
         # 首先清理现有订单和持仓
-        cleanup_before_setup()
+        await cleanup_before_setup()
 
         # 设置持仓模式为双向持仓
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                print(f"⚙️ 设置持仓模式 (第{attempt + 1}次尝试)...")
+                logger.info("⚙️ 设置持仓模式 (第%s次尝试)...", attempt + 1)
 
                 # 使用最简单的参数设置持仓模式
-                position_mode_response = exchange.privatePostAccountSetPositionMode({
-                    'posMode': 'long_short_mode'
-                })
+                async with _BUCKETS['position_mode']:
+                    position_mode_response = await exchange.privatePostAccountSetPositionMode({
+                        'posMode': 'long_short_mode'
+                    })
 
                 if position_mode_response.get('code') == '0':
-                    print("✅ 双向持仓模式设置成功")
+                    logger.info("✅ 双向持仓模式设置成功")
                     break
                 elif position_mode_response.get('code') == '59000':
-                    print(f"❌ 设置持仓模式失败: 需要先取消订单和平仓")
+                    logger.error("❌ 设置持仓模式失败: 需要先取消订单和平仓")
                     if attempt < max_retries - 1:
-                        print("🔄 重新尝试清理并设置...")
-                        cleanup_before_setup()
-                        time.sleep(5)
+                        logger.info("🔄 重新尝试清理并设置...")
+                        await cleanup_before_setup()
+                        await asyncio.sleep(5)
                         continue
                     else:
-                        print("❌ 多次尝试设置持仓模式均失败")
+                        logger.error("❌ 多次尝试设置持仓模式均失败")
                         # 尝试继续运行，可能使用默认模式
-                        print("⚠️ 使用默认持仓模式继续运行")
+                        logger.warning("⚠️ 使用默认持仓模式继续运行")
                         break
                 else:
-                    print(f"⚠️ 持仓模式设置返回: {position_mode_response}")
+                    logger.warning("⚠️ 持仓模式设置返回: %s", position_mode_response)
                     break
 
             except Exception as e:
-                print(f"⚠️ 持仓模式设置警告 (第{attempt + 1}次): {e}")
+                logger.warning("⚠️ 持仓模式设置警告 (第%s次): %s", attempt + 1, e)
                 if attempt < max_retries - 1:
-                    time.sleep(2)
+                    await asyncio.sleep(2)
                 else:
-                    print("❌ 持仓模式设置最终失败")
+                    logger.error("❌ 持仓模式设置最终失败")
                     break
 
         # 设置杠杆
         try:
-            print("⚙️ 设置杠杆...")
+            logger.info("⚙️ 设置杠杆...")
 
             # 方法1: 使用CCXT内置方法设置杠杆
             try:
-                exchange.set_leverage(
-                    leverage=TRADE_CONFIG['leverage'],
-                    symbol='OKB/USDT:USDT'
-                )
-                print(f"✅ CCXT杠杆设置成功: {TRADE_CONFIG['leverage']}x")
+                async with _BUCKETS['account']:
+                    await exchange.set_leverage(
+                        leverage=TRADE_CONFIG['leverage'],
+                        symbol='OKB/USDT:USDT'
+                    )
+                logger.info("✅ CCXT杠杆设置成功: %sx", TRADE_CONFIG['leverage'])
             except Exception as e:
-                print(f"⚠️ CCXT杠杆设置失败: {e}")
+                logger.warning("⚠️ CCXT杠杆设置失败: %s", e)
                 # 方法2: 使用简化参数手动设置
-                leverage_response = exchange.privatePostAccountSetLeverage({
-                    'instId': 'OKB-USDT-SWAP',
-                    'lever': str(TRADE_CONFIG['leverage'])
-                })
+                async with _BUCKETS['account']:
+                    leverage_response = await exchange.privatePostAccountSetLeverage({
+                        'instId': 'OKB-USDT-SWAP',
+                        'lever': str(TRADE_CONFIG['leverage'])
+                    })
                 if leverage_response.get('code') == '0':
-                    print(f"✅ 简化参数杠杆设置成功: {TRADE_CONFIG['leverage']}x")
+                    logger.info("✅ 简化参数杠杆设置成功: %sx", TRADE_CONFIG['leverage'])
                 else:
-                    print(f"⚠️ 简化参数杠杆设置返回: {leverage_response}")
+                    logger.warning("⚠️ 简化参数杠杆设置返回: %s", leverage_response)
 
         except Exception as e:
-            print(f"⚠️ 杠杆设置警告: {e}")
+            logger.warning("⚠️ 杠杆设置警告: %s", e)
 
         # 检查余额
-        usdt_balance = get_usdt_balance()
-        print(f"💰 当前USDT余额: {usdt_balance:.2f}")
+        usdt_balance = await get_usdt_balance()
+        logger.info("💰 当前USDT余额: %.2f", usdt_balance)
 
         return True
     except Exception as e:
-        print(f"交易所设置失败: {e}")
+        logger.error("交易所设置失败: %s", e)
         return True
 
 
+def move_window(func, values, window, min_count, **kwargs):
+    """调用bottleneck滑动窗口函数，窗口超过数据长度时按数据长度截断"""
+    if len(values) < min_count:
+        return np.full(len(values), np.nan)
+    return func(values, window=min(window, len(values)), min_count=min_count, **kwargs)
+
+
 def calculate_technical_indicators(df):
     """计算技术指标"""
     try:
+        # 滑动窗口统计使用bottleneck的C实现，直接作用于收盘价数组
+        close = df['close'].to_numpy(dtype=float)
+
         # 移动平均线
-        df['sma_5'] = df['close'].rolling(window=5, min_periods=1).mean()
-        df['sma_20'] = df['close'].rolling(window=20, min_periods=1).mean()
-        df['sma_50'] = df['close'].rolling(window=50, min_periods=1).mean()
+        df['sma_5'] = move_window(bn.move_mean, close, 5, min_count=1)
+        df['sma_20'] = move_window(bn.move_mean, close, 20, min_count=1)
+        df['sma_50'] = move_window(bn.move_mean, close, 50, min_count=1)
 
-        # 指数移动平均线
+        # 指数移动平均线（bottleneck没有EMA，仍使用pandas的ewm）
         df['ema_12'] = df['close'].ewm(span=12).mean()
         df['ema_26'] = df['close'].ewm(span=26).mean()
         df['macd'] = df['ema_12'] - df['ema_26']
@@ -484,26 +715,109 @@ def calculate_technical_indicators(df):
         df['macd_histogram'] = df['macd'] - df['macd_signal']
 
         # RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-        rs = gain / loss
-        df['rsi'] = 100 - (100 / (1 + rs))
+        # 首根K线的涨跌记为0，与pandas diff后where填0一致
+        delta = np.diff(close, prepend=close[:1])
+        gain = move_window(bn.move_mean, np.maximum(delta, 0), 14, min_count=1)
+        loss = move_window(bn.move_mean, np.maximum(-delta, 0), 14, min_count=1)
+        # 无下跌时RSI为100，完全无波动时取中性值50
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = 100 - (100 / (1 + gain / loss))
+        df['rsi'] = np.where(loss > 0, rsi, np.where(gain > 0, 100.0, 50.0))
+
+        # 布林带，中轨即20周期均线，单根K线的标准差按0处理
+        bb_middle = df['sma_20'].to_numpy()
+        bb_std = np.nan_to_num(move_window(bn.move_std, close, 20, min_count=1, ddof=1))
+        bb_upper = bb_middle + (bb_std * 2)
+        bb_lower = bb_middle - (bb_std * 2)
+        bb_width = bb_upper - bb_lower
+        df['bb_middle'] = bb_middle
+        df['bb_upper'] = bb_upper
+        df['bb_lower'] = bb_lower
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bb_position = (close - bb_lower) / bb_width
+        df['bb_position'] = np.where(bb_width > 0, bb_position, 0.5)
 
-        # 布林带
-        df['bb_middle'] = df['close'].rolling(20).mean()
-        bb_std = df['close'].rolling(20).std()
-        df['bb_upper'] = df['bb_middle'] + (bb_std * 2)
-        df['bb_lower'] = df['bb_middle'] - (bb_std * 2)
-        df['bb_position'] = (df['close'] - df['bb_lower']) / (df['bb_upper'] - df['bb_lower'])
-
-        df = df.bfill().ffill()
         return df
     except Exception as e:
-        print(f"技术指标计算失败: {e}")
+        logger.error("技术指标计算失败: %s", e)
         return df
 
 
+def update_technical_indicators(df, start):
+    """从第start行开始增量更新技术指标，之前的行保持不变"""
+    close = df['close'].to_numpy(dtype=float)
+    alpha_12, alpha_26, alpha_9 = 2 / 13, 2 / 27, 2 / 10
+    columns = ['sma_5', 'sma_20', 'sma_50', 'ema_12', 'ema_26', 'macd', 'macd_signal',
+               'macd_histogram', 'rsi', 'bb_middle', 'bb_upper', 'bb_lower', 'bb_position']
+
+    # 数值列一次性取出为数组，在数组上更新末尾几行后重建DataFrame，避免逐行逐列的pandas写入开销
+    numeric_columns = df.columns[1:]
+    values = df[numeric_columns].to_numpy(dtype=float, copy=True)
+    indicator_idx = numeric_columns.get_indexer(columns)
+    # 上次全量计算失败时没有指标列，改为全量重算
+    if (indicator_idx < 0).any():
+        return calculate_technical_indicators(df)
+    # 递推起点为上一行的ema_12、ema_26、macd_signal
+    ema_12, ema_26, macd_signal = values[start - 1, numeric_columns.get_indexer(['ema_12', 'ema_26', 'macd_signal'])]
+
+    for i in range(start, len(close)):
+        # 移动平均线
+        sma_5 = close[max(0, i - 4):i + 1].mean()
+        sma_20 = close[max(0, i - 19):i + 1].mean()
+        sma_50 = close[max(0, i - 49):i + 1].mean()
+
+        # 指数移动平均线按递推公式更新
+        ema_12 = alpha_12 * close[i] + (1 - alpha_12) * ema_12
+        ema_26 = alpha_26 * close[i] + (1 - alpha_26) * ema_26
+        macd = ema_12 - ema_26
+        macd_signal = alpha_9 * macd + (1 - alpha_9) * macd_signal
+
+        # RSI
+        delta = np.diff(close[max(0, i - 14):i + 1])
+        gain = delta[delta > 0].sum() / 14
+        loss = -delta[delta < 0].sum() / 14
+        rsi = 100 - (100 / (1 + gain / loss)) if loss > 0 else (100.0 if gain > 0 else 50.0)
+
+        # 布林带
+        window = close[max(0, i - 19):i + 1]
+        bb_std = window.std(ddof=1)
+        bb_upper = sma_20 + bb_std * 2
+        bb_lower = sma_20 - bb_std * 2
+        bb_width = bb_upper - bb_lower
+        bb_position = (close[i] - bb_lower) / bb_width if bb_width > 0 else 0.5
+
+        values[i, indicator_idx] = (sma_5, sma_20, sma_50, ema_12, ema_26, macd, macd_signal,
+                                    macd - macd_signal, rsi, sma_20, bb_upper, bb_lower, bb_position)
+
+    updated = pd.DataFrame(values, columns=numeric_columns)
+    updated.insert(0, 'timestamp', df['timestamp'].to_numpy())
+    return updated
+
+
+def merge_ohlcv(df, ohlcv):
+    """将最新K线合并到已有状态，返回合并后的数据和首个变化行，无法衔接时返回None"""
+    # 直接在原始K线列表上比较毫秒时间戳，找出最后一根及之后的K线
+    last_ts = df['timestamp'].iloc[-1].value // 1_000_000
+    bars = [bar for bar in ohlcv if bar[0] >= last_ts]
+    # 最新K线与已有状态之间有缺口，需要全量重算
+    if not bars or bars[0][0] != last_ts:
+        return None, None
+
+    # 最后一根K线可能在上次获取后继续变化，连同新K线整体替换，其指标留空随后重算
+    # 数值列在数组上拼接并裁剪到固定长度，只构造一次DataFrame
+    new = np.array(bars, dtype=float)
+    start = len(df) - 1
+    keep = max(0, start + len(new) - TRADE_CONFIG['data_points'])
+    numeric_columns = df.columns[1:]
+    tail = np.full((len(new), len(numeric_columns)), np.nan)
+    tail[:, :len(OHLCV_COLUMNS) - 1] = new[:, 1:]
+    merged = pd.DataFrame(np.vstack([df[numeric_columns].to_numpy(dtype=float)[keep:start], tail]),
+                          columns=numeric_columns)
+    merged.insert(0, 'timestamp', np.concatenate([df['timestamp'].to_numpy()[keep:start],
+                                                  pd.to_datetime(new[:, 0].astype('int64'), unit='ms').to_numpy()]))
+    return merged, start - keep
+
+
 def get_market_trend(df):
     """判断市场趋势"""
     try:
@@ -527,28 +841,45 @@ def get_market_trend(df):
             'rsi_level': df['rsi'].iloc[-1]
         }
     except Exception as e:
-        print(f"趋势分析失败: {e}")
+        logger.error("趋势分析失败: %s", e)
         return {}
 
 
-def get_OKB_ohlcv_enhanced():
+async def get_OKB_ohlcv_enhanced():
     """获取OKB K线数据并计算技术指标"""
+    global df_state
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            print(f"📊 获取K线数据 (第{attempt + 1}次尝试)...")
-            ohlcv = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
-                                         limit=TRADE_CONFIG['data_points'])
+            logger.debug("📊 获取K线数据 (第%s次尝试)...", attempt + 1)
+            # 热启动优先使用推送的K线，否则只拉取最新几根；冷启动拉取完整数据
+            ohlcv = get_ws_ohlcv() if df_state is not None else None
+            if ohlcv is None:
+                limit = INCREMENTAL_FETCH_BARS if df_state is not None else TRADE_CONFIG['data_points']
+                async with _BUCKETS['market']:
+                    ohlcv = await exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
+                                                       limit=limit)
 
             if not ohlcv or len(ohlcv) == 0:
                 if attempt < max_retries - 1:
-                    time.sleep(2)
+                    await asyncio.sleep(2)
                     continue
                 return None
 
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df = calculate_technical_indicators(df)
+            df, start = (None, None) if df_state is None else merge_ohlcv(df_state, ohlcv)
+            if df is None:
+                if df_state is not None:
+                    logger.warning("⚠️ K线数据不连续，重新全量获取")
+                    async with _BUCKETS['market']:
+                        ohlcv = await exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
+                                                           limit=TRADE_CONFIG['data_points'])
+                df = pd.DataFrame(ohlcv, columns=OHLCV_COLUMNS)
+                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+                df = calculate_technical_indicators(df)
+            else:
+                df = update_technical_indicators(df, start)
+            df_state = df
 
             current_data = df.iloc[-1]
             previous_data = df.iloc[-2]
@@ -557,14 +888,12 @@ def get_OKB_ohlcv_enhanced():
 
             return {
                 'price': float(current_data['close']),
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'high': float(current_data['high']),
                 'low': float(current_data['low']),
                 'volume': float(current_data['volume']),
                 'timeframe': TRADE_CONFIG['timeframe'],
                 'price_change': float(
                     ((current_data['close'] - previous_data['close']) / max(previous_data['close'], 0.0001)) * 100),
-                'kline_data': df[['timestamp', 'open', 'high', 'low', 'close', 'volume']].tail(10).to_dict('records'),
                 'technical_data': {
                     'sma_5': float(current_data.get('sma_5', 0)),
                     'sma_20': float(current_data.get('sma_20', 0)),
@@ -573,13 +902,13 @@ def get_OKB_ohlcv_enhanced():
                     'macd': float(current_data.get('macd', 0)),
                     'macd_signal': float(current_data.get('macd_signal', 0)),
                 },
-                'trend_analysis': trend_analysis,
-                'full_data': df
+                'trend_analysis': trend_analysis
             }
         except Exception as e:
-            print(f"❌ 获取K线数据失败 (第{attempt + 1}次): {e}")
+            logger.error("❌ 获取K线数据失败 (第%s次): %s", attempt + 1, e)
+            df_state = None
             if attempt < max_retries - 1:
-                time.sleep(2)
+                await asyncio.sleep(2)
             else:
                 return None
     return None
@@ -597,186 +926,199 @@ def create_fallback_signal(price_data):
     }
 
 
-def analyze_with_deepseek(price_data):
+async def analyze_with_deepseek(price_data):
     """使用DeepSeek分析市场并生成交易信号"""
     if not deepseek_client:
         return create_fallback_signal(price_data)
 
+    # 震荡行情下AI几乎总是给出低信心观望信号，直接跳过调用
+    rsi = price_data['technical_data'].get('rsi', 0)
+    if (price_data['trend_analysis'].get('overall') == '震荡整理'
+            and TRADE_CONFIG['skip_ai_rsi_low'] <= rsi <= TRADE_CONFIG['skip_ai_rsi_high']
+            and abs(price_data['price_change']) < TRADE_CONFIG['skip_ai_max_change']):
+        logger.info("⏸️ 震荡整理且RSI中性(%.1f)，跳过DeepSeek分析", rsi)
+        signal_data = create_fallback_signal(price_data)
+        # 主动跳过不属于分析失败，不标记为备用信号
+        signal_data['reason'] = "震荡整理且RSI中性，观望"
+        signal_data['is_fallback'] = False
+        signal_data['skipped_ai'] = True
+        return signal_data
+
     try:
-        prompt = f"""
-        基于以下OKB/USDT {TRADE_CONFIG['timeframe']}周期数据进行分析：
-        当前价格: ${price_data['price']:,.2f}
-        价格变化: {price_data['price_change']:+.2f}%
-        趋势: {price_data['trend_analysis'].get('overall', 'N/A')}
-        RSI: {price_data['technical_data'].get('rsi', 0):.1f}
-
-        请给出交易信号，用JSON格式回复：
-        {{
-            "signal": "BUY|SELL|HOLD",
-            "reason": "分析理由",
-            "stop_loss": 具体价格,
-            "take_profit": 具体价格, 
-            "confidence": "HIGH|MEDIUM|LOW"
-        }}
-        """
-
-        response = deepseek_client.chat.completions.create(
+        prompt = _PROMPT_TMPL(price=price_data['price'], chg=price_data['price_change'], rsi=rsi,
+                              trend=price_data['trend_analysis'].get('overall', 'N/A'))
+
+        response = await deepseek_client.chat.completions.create(
             model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": SIGNAL_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=120,
             stream=False,
             temperature=0.1
         )
 
         result = response.choices[0].message.content
-        print(f"🧠 DeepSeek回复: {result}")
+        logger.debug("🧠 DeepSeek回复: %s", result)
 
-        # 解析JSON
+        # JSON模式下回复即为JSON对象，偶尔可能为空
         try:
-            start_idx = result.find('{')
-            end_idx = result.rfind('}') + 1
-            if start_idx != -1 and end_idx != 0:
-                json_str = result[start_idx:end_idx]
-                signal_data = json.loads(json_str)
-
-                required_fields = ['signal', 'reason', 'stop_loss', 'take_profit', 'confidence']
-                if all(field in signal_data for field in required_fields):
-                    signal_data['timestamp'] = price_data['timestamp']
-                    signal_history.append(signal_data)
-                    if len(signal_history) > 30:
-                        signal_history.pop(0)
-                    return signal_data
-        except:
-            pass
+            signal_data = orjson.loads(result) if result else None
+        except orjson.JSONDecodeError as e:
+            logger.warning("⚠️ DeepSeek回复JSON解析失败: %s", e)
+            signal_data = None
+
+        required_fields = ['signal', 'reason', 'stop_loss', 'take_profit', 'confidence']
+        if isinstance(signal_data, dict) and all(field in signal_data for field in required_fields):
+            signal_history.append(signal_data)
+            return signal_data
 
         return create_fallback_signal(price_data)
 
     except Exception as e:
-        print(f"❌ DeepSeek分析失败: {e}")
+        logger.error("❌ DeepSeek分析失败: %s", e)
         return create_fallback_signal(price_data)
 
 
-def execute_trade(signal_data, price_data):
+async def submit_orders(orders):
+    """提交订单，多个订单合并为一次批量下单请求，返回每个订单的结果码
+
+    批量下单不是原子操作，平仓单失败而开仓单成交时立即用只减仓单撤回开仓，
+    避免同时持有多空两个方向的仓位，被撤回的开仓单结果码记为'reverted'
+    """
+    if len(orders) == 1:
+        async with _BUCKETS['trade']:
+            response = await exchange.privatePostTradeOrder(orders[0])
+        codes = [response.get('code', 'N/A')]
+    else:
+        async with _BUCKETS['trade']:
+            response = await exchange.privatePostTradeBatchOrders(orders)
+        data = response.get('data', [])
+        if len(data) == len(orders):
+            codes = [item.get('sCode', 'N/A') for item in data]
+        else:
+            codes = [response.get('code', 'N/A')] * len(orders)
+
+    if any(code != '0' for code in codes):
+        logger.error("❌ 下单失败: %s", response)
+
+    if len(orders) > 1 and codes[0] != '0' and codes[-1] == '0':
+        opened = orders[-1]
+        revert_params = {**opened, 'side': 'sell' if opened['side'] == 'buy' else 'buy', 'reduceOnly': True}
+        try:
+            async with _BUCKETS['trade']:
+                revert_response = await exchange.privatePostTradeOrder(revert_params)
+            if revert_response.get('code') == '0':
+                logger.warning("⚠️ 平仓失败，已撤回开仓: %s %s", opened['posSide'], opened['sz'])
+                codes[-1] = 'reverted'
+            else:
+                logger.error("❌ 撤回开仓失败，可能同时持有多空仓位: %s", revert_response)
+        except Exception as e:
+            logger.error("❌ 撤回开仓失败，可能同时持有多空仓位: %s", e)
+    return codes
+
+
+def log_order_results(labels, codes):
+    """按订单输出下单结果，失败的订单记为错误"""
+    for label, code in zip(labels, codes):
+        if code == '0':
+            logger.info("✅ %s结果: %s", label, code)
+        else:
+            logger.error("❌ %s失败: %s", label, code)
+
+
+async def execute_trade(signal_data, price_data, current_position):
     """执行交易 - 修复版本"""
     global position
 
-    current_position = get_current_position()
     current_price = price_data['price']
 
-    print(f"📈 交易信号: {signal_data['signal']}")
-    print(f"📊 信心程度: {signal_data['confidence']}")
+    logger.info("📈 交易信号: %s", signal_data['signal'])
+    logger.info("📊 信心程度: %s", signal_data['confidence'])
 
     # 严格的风险管理
     if signal_data['confidence'] == 'LOW':
-        print("⚠️ 低信心信号，跳过执行")
+        logger.warning("⚠️ 低信心信号，跳过执行")
         return
 
     if TRADE_CONFIG['test_mode']:
-        print("🧪 测试模式 - 仅模拟交易")
+        logger.info("🧪 测试模式 - 仅模拟交易")
         return
 
     try:
-        # 计算仓位大小
-        position_size, actual_notional, required_margin = calculate_position_size(current_price)
+        # 计算仓位大小并查询余额
+        (position_size, actual_notional, required_margin), usdt_balance = await asyncio.gather(
+            calculate_position_size(current_price),
+            get_usdt_balance()
+        )
 
         # 严格的余额检查
-        usdt_balance = get_usdt_balance()
         if required_margin > usdt_balance * 0.6:
-            print(f"❌ 保证金不足，取消交易")
+            logger.error("❌ 保证金不足，取消交易")
             return
 
         if actual_notional > TRADE_CONFIG['max_position_value']:
-            print(f"❌ 开仓价值超过限制: ${actual_notional:.2f} > ${TRADE_CONFIG['max_position_value']}")
+            logger.error("❌ 开仓价值超过限制: $%.2f > $%s", actual_notional, TRADE_CONFIG['max_position_value'])
             return
 
         # 最小开仓价值检查
         if actual_notional < 3.0:
-            print(f"⚠️ 开仓价值过小 (${actual_notional:.2f})，可能不划算")
+            logger.warning("⚠️ 开仓价值过小 ($%.2f)，可能不划算", actual_notional)
             return
 
         # 检查最大持仓限制
         if current_position:
-            current_notional = current_position['size'] * get_contract_specs()['contract_value'] * current_price
+            current_notional = current_position['size'] * (await get_contract_specs())['contract_value'] * current_price
             if current_notional + actual_notional > TRADE_CONFIG['max_position_value']:
-                print(f"⚠️ 超过最大持仓限制，跳过交易。当前: ${current_notional:.2f}, 新增: ${actual_notional:.2f}")
+                logger.warning("⚠️ 超过最大持仓限制，跳过交易。当前: $%.2f, 新增: $%.2f", current_notional, actual_notional)
                 return
 
         # 执行交易
+        results = []
         if signal_data['signal'] == 'BUY':
+            orders = []
             if current_position and current_position['side'] == 'short':
-                print("🔄 平空仓并开多仓...")
+                logger.info("🔄 平空仓并开多仓...")
                 # 平空仓
-                close_params = {
-                    'instId': 'OKB-USDT-SWAP',
-                    'tdMode': 'isolated',
-                    'side': 'buy',
-                    'posSide': 'short',
-                    'ordType': 'market',
-                    'sz': str(current_position['size']),
-                    'reduceOnly': True
-                }
-                close_response = exchange.privatePostTradeOrder(close_params)
-                print(f"✅ 平空仓结果: {close_response.get('code', 'N/A')}")
-                if close_response.get('code') != '0':
-                    print(f"❌ 平仓失败: {close_response}")
-                    return
-                time.sleep(2)
-
-            # 开多仓
-            print("📈 开多仓...")
-            open_params = {
-                'instId': 'OKB-USDT-SWAP',
-                'tdMode': 'isolated',
-                'side': 'buy',
-                'posSide': 'long',
-                'ordType': 'market',
-                'sz': str(position_size)
-            }
-            response = exchange.privatePostTradeOrder(open_params)
-            print(f"✅ 开多仓结果: {response.get('code', 'N/A')}")
+                orders.append({**_BASE_ORDER, 'side': 'buy', 'posSide': 'short',
+                               'sz': str(current_position['size']), 'reduceOnly': True})
+
+            # 开多仓，有反向持仓时与平仓单合并为一次批量下单
+            logger.info("📈 开多仓...")
+            orders.append({**_BASE_ORDER, 'side': 'buy', 'posSide': 'long', 'sz': str(position_size)})
+            results = await submit_orders(orders)
+            log_order_results(['平空仓', '开多仓'][-len(results):], results)
 
         elif signal_data['signal'] == 'SELL':
+            orders = []
             if current_position and current_position['side'] == 'long':
-                print("🔄 平多仓并开空仓...")
+                logger.info("🔄 平多仓并开空仓...")
                 # 平多仓
-                close_params = {
-                    'instId': 'OKB-USDT-SWAP',
-                    'tdMode': 'isolated',
-                    'side': 'sell',
-                    'posSide': 'long',
-                    'ordType': 'market',
-                    'sz': str(current_position['size']),
-                    'reduceOnly': True
-                }
-                close_response = exchange.privatePostTradeOrder(close_params)
-                print(f"✅ 平多仓结果: {close_response.get('code', 'N/A')}")
-                if close_response.get('code') != '0':
-                    print(f"❌ 平仓失败: {close_response}")
-                    return
-                time.sleep(2)
-
-            # 开空仓
-            print("📉 开空仓...")
-            open_params = {
-                'instId': 'OKB-USDT-SWAP',
-                'tdMode': 'isolated',
-                'side': 'sell',
-                'posSide': 'short',
-                'ordType': 'market',
-                'sz': str(position_size)
-            }
-            response = exchange.privatePostTradeOrder(open_params)
-            print(f"✅ 开空仓结果: {response.get('code', 'N/A')}")
+                orders.append({**_BASE_ORDER, 'side': 'sell', 'posSide': 'long',
+                               'sz': str(current_position['size']), 'reduceOnly': True})
+
+            # 开空仓，有反向持仓时与平仓单合并为一次批量下单
+            logger.info("📉 开空仓...")
+            orders.append({**_BASE_ORDER, 'side': 'sell', 'posSide': 'short', 'sz': str(position_size)})
+            results = await submit_orders(orders)
+            log_order_results(['平多仓', '开空仓'][-len(results):], results)
 
         elif signal_data['signal'] == 'HOLD':
-            print("⏸️ 建议观望，不执行交易")
+            logger.info("⏸️ 建议观望，不执行交易")
             return
 
-        print("✅ 订单执行完成")
-        time.sleep(3)
-        position = get_current_position()
+        if all(code == '0' for code in results):
+            logger.info("✅ 订单执行完成")
+        else:
+            logger.error("❌ 订单未全部成功: %s", results)
+        invalidate_position_cache()
+        await asyncio.sleep(3)
+        position = await get_current_position()
 
     except Exception as e:
-        print(f"❌ 订单执行失败: {e}")
+        logger.error("❌ 订单执行失败: %s", e)
 
 
 def wait_for_next_period():
@@ -797,90 +1139,129 @@ def wait_for_next_period():
     seconds_to_wait = minutes_to_wait * 60 - current_second
 
     if minutes_to_wait > 0:
-        print(f"🕒 等待 {minutes_to_wait} 分 {seconds_to_wait % 60} 秒到整点...")
+        logger.info("🕒 等待 %s 分 %s 秒到整点...", minutes_to_wait, seconds_to_wait % 60)
     else:
-        print(f"🕒 等待 {seconds_to_wait} 秒到整点...")
+        logger.info("🕒 等待 %s 秒到整点...", seconds_to_wait)
 
     return seconds_to_wait
 
 
-def trading_bot():
+async def trading_bot():
     """主交易机器人函数"""
-    wait_seconds = wait_for_next_period()
-    if wait_seconds > 0:
-        time.sleep(wait_seconds)
-
-    print("\n" + "=" * 60)
-    print(f"⏰ 执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 60)
-
-    # 获取价格数据
-    price_data = get_OKB_ohlcv_enhanced()
+    logger.info("=" * 60)
+    logger.info("⏰ 开始新的交易周期")
+    logger.info("=" * 60)
+
+    # 并发获取价格数据和当前持仓
+    price_data, current_position = await asyncio.gather(
+        get_OKB_ohlcv_enhanced(),
+        get_current_position()
+    )
     if not price_data:
-        print("❌ 无法获取价格数据，跳过本次执行")
+        logger.error("❌ 无法获取价格数据，跳过本次执行")
         return
 
-    print(f"💰 OKB当前价格: ${price_data['price']:,.2f}")
-    print(f"📈 价格变化: {price_data['price_change']:+.2f}%")
+    logger.info("💰 OKB当前价格: $%.2f", price_data['price'])
+    logger.info("📈 价格变化: %+.2f%%", price_data['price_change'])
 
     # 生成交易信号
-    signal_data = analyze_with_deepseek(price_data)
+    signal_data = await analyze_with_deepseek(price_data)
     if signal_data.get('is_fallback', False):
-        print("⚠️ 使用备用交易信号")
+        logger.warning("⚠️ 使用备用交易信号")
 
     # 执行交易
-    execute_trade(signal_data, price_data)
+    await execute_trade(signal_data, price_data, current_position)
+
+
+def setup_logging():
+    """配置日志：事件循环线程只把日志放入队列，由后台线程写入按大小轮转的文件和标准输出"""
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    handlers = (
+        RotatingFileHandler(os.getenv('LOG_FILE', 'bot.log'), maxBytes=5_000_000, backupCount=3, encoding='utf-8'),
+        logging.StreamHandler(sys.stdout),
+    )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
+
+
+async def main():
+    """主函数"""
+    log_listener = setup_logging()
+    try:
+        await run_bot()
+    finally:
+        # 停止日志线程，停止前会写出队列中剩余的日志
+        log_listener.stop()
 
 
-def main():
-    """主函数"""
+async def run_bot():
+    """检查配置、初始化交易所并运行主循环"""
+    global exchange, deepseek_client
+
     required_env_vars = ['OKX_API_KEY', 'OKX_SECRET', 'OKX_PASSWORD', 'DEEPSEEK_API_KEY']
     missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
     if missing_vars:
-        print(f"❌ 缺少环境变量: {missing_vars}")
+        logger.error("❌ 缺少环境变量: %s", missing_vars)
         return
 
-    print("🤖 OKB/USDT OKX自动交易机器人启动成功！")
-    print("🎯 10美元本金安全优化版")
+    logger.info("🤖 OKB/USDT OKX自动交易机器人启动成功！")
+    logger.info("🎯 10美元本金安全优化版")
 
     if TRADE_CONFIG['test_mode']:
-        print("🧪 当前为测试模式")
+        logger.info("🧪 当前为测试模式")
     else:
-        print("💰 实盘交易模式，请谨慎操作！")
+        logger.info("💰 实盘交易模式，请谨慎操作！")
 
-    print(f"⏰ 交易周期: {TRADE_CONFIG['timeframe']}")
-    print(f"🎯 目标开仓价值: ${TRADE_CONFIG['target_notional']}")
-    print(f"📊 杠杆倍数: {TRADE_CONFIG['leverage']}x")
-    print(f"🔐 最大持仓: ${TRADE_CONFIG['max_position_value']}")
+    logger.info("⏰ 交易周期: %s", TRADE_CONFIG['timeframe'])
+    logger.info("🎯 目标开仓价值: $%s", TRADE_CONFIG['target_notional'])
+    logger.info("📊 杠杆倍数: %sx", TRADE_CONFIG['leverage'])
+    logger.info("🔐 最大持仓: $%s", TRADE_CONFIG['max_position_value'])
 
+    deepseek_client = setup_deepseek_client()
     if deepseek_client is None:
-        print("❌ DeepSeek客户端初始化失败")
+        logger.error("❌ DeepSeek客户端初始化失败")
         return
+    exchange = await setup_okx_exchange()
     if exchange is None:
-        print("❌ OKX交易所初始化失败")
+        logger.error("❌ OKX交易所初始化失败")
         return
 
-    if not setup_exchange():
-        print("❌ 交易所设置失败")
-        return
-
-    print("🔁 开始主循环...")
-
-    # 先执行一次
-    trading_bot()
+    # 启动K线和持仓推送，清理阶段即可使用持仓推送，推送就绪前使用REST查询
+    ws_tasks = [asyncio.create_task(watch_ohlcv_loop()), asyncio.create_task(watch_positions_loop())]
+    try:
+        if not await setup_exchange():
+            logger.error("❌ 交易所设置失败")
+            return
 
-    # 然后按计划执行
-    schedule.every(5).minutes.do(trading_bot)
+        logger.info("🔁 开始主循环...")
 
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-        except Exception as e:
-            print(f"❌ 执行周期出错: {e}")
-            time.sleep(60)
+        # 每次直接休眠到下一个5分钟整点再执行
+        while True:
+            try:
+                wait_seconds = wait_for_next_period()
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+                await trading_bot()
+            except Exception as e:
+                logger.error("❌ 执行周期出错: %s", e)
+                await asyncio.sleep(60)
+    finally:
+        for task in ws_tasks:
+            task.cancel()
+        await asyncio.gather(*ws_tasks, return_exceptions=True)
+        await exchange.close()
+        await deepseek_client.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+import random
+
+import numpy as np
+import pandas as pd
+from aiolimiter import AsyncLimiter
+
+import okx
+
+COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+# 增量EMA使用递推公式，与ewm(adjust=True)的全量结果仅在早期权重上有微小差异
+EXACT_COLUMNS = ['sma_5', 'sma_20', 'sma_50', 'rsi', 'bb_middle', 'bb_upper', 'bb_lower', 'bb_position']
+EMA_COLUMNS = ['ema_12', 'ema_26', 'macd', 'macd_signal', 'macd_histogram']
+
+
+def make_bars(count, seed=1):
+    rng = random.Random(seed)
+    base = 1_700_000_000_000
+    price = 50.0
+    bars = []
+    for i in range(count):
+        price += rng.uniform(-1, 1)
+        bars.append([base + i * 300000, price, price + 1, price - 1, price + rng.uniform(-0.5, 0.5), 10.0])
+    return bars
+
+
+def cold_start(bars):
+    df = pd.DataFrame(bars, columns=COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    return okx.calculate_technical_indicators(df)
+
+
+def test_incremental_matches_cold_start():
+    points = okx.TRADE_CONFIG['data_points']
+    bars = make_bars(points + 20)
+    df = cold_start(bars[:points])
+
+    # 每个周期推送最近3根K线，其中最后一根可能是尚未收盘的K线
+    for end in range(points + 1, len(bars) + 1):
+        latest = [list(bar) for bar in bars[end - 3:end]]
+        latest[-1][4] += 0.1
+        df, start = okx.merge_ohlcv(df, latest)
+        assert df is not None
+        df = okx.update_technical_indicators(df, start)
+
+        expected = cold_start(df[COLUMNS].assign(timestamp=df['timestamp'].astype('int64') // 1_000_000)
+                              .to_numpy().tolist())
+        assert len(df) == points
+        np.testing.assert_allclose(df[EXACT_COLUMNS].iloc[-3:], expected[EXACT_COLUMNS].iloc[-3:], rtol=1e-9)
+        np.testing.assert_allclose(df[EMA_COLUMNS].iloc[-3:], expected[EMA_COLUMNS].iloc[-3:], atol=1e-2)
+
+
+def test_merge_rejects_gap():
+    points = okx.TRADE_CONFIG['data_points']
+    bars = make_bars(points + 10)
+    df = cold_start(bars[:points])
+    assert okx.merge_ohlcv(df, bars[-3:]) == (None, None)
+
+
+def test_update_without_indicators_falls_back_to_cold_start():
+    points = okx.TRADE_CONFIG['data_points']
+    bars = make_bars(points + 2)
+    df = pd.DataFrame(bars[:points], columns=COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+
+    df, start = okx.merge_ohlcv(df, bars[points - 1:])
+    df = okx.update_technical_indicators(df, start)
+
+    expected = cold_start(bars[2:])
+    np.testing.assert_allclose(df[EXACT_COLUMNS + EMA_COLUMNS], expected[EXACT_COLUMNS + EMA_COLUMNS])
+    assert df['volume'].eq(10.0).all()
+
+
+class FakeOrderExchange:
+    """记录下单请求的假交易所，批量下单和单笔下单返回预设结果"""
+
+    def __init__(self, batch_response, order_response=None):
+        self.batch_response = batch_response
+        self.order_response = order_response or {'code': '0'}
+        self.orders = []
+
+    async def privatePostTradeBatchOrders(self, orders):
+        return self.batch_response
+
+    async def privatePostTradeOrder(self, params):
+        self.orders.append(params)
+        if isinstance(self.order_response, Exception):
+            raise self.order_response
+        return self.order_response
+
+
+FLIP_ORDERS = [
+    {**okx._BASE_ORDER, 'side': 'sell', 'posSide': 'long', 'sz': '2.0', 'reduceOnly': True},
+    {**okx._BASE_ORDER, 'side': 'sell', 'posSide': 'short', 'sz': '1.0'},
+]
+
+
+def submit_flip(monkeypatch, batch_response, order_response=None):
+    exchange = FakeOrderExchange(batch_response, order_response)
+    monkeypatch.setattr(okx, 'exchange', exchange)
+    # 限速桶绑定事件循环，每次asyncio.run使用新的限速桶
+    monkeypatch.setitem(okx._BUCKETS, 'trade', AsyncLimiter(20, 2))
+    return exchange, asyncio.run(okx.submit_orders(FLIP_ORDERS))
+
+
+def test_submit_orders_reverts_open_leg_when_close_fails(monkeypatch):
+    exchange, codes = submit_flip(monkeypatch, {'code': '2', 'data': [{'sCode': '51000'}, {'sCode': '0'}]})
+
+    assert codes == ['51000', 'reverted']
+    assert len(exchange.orders) == 1
+    revert = exchange.orders[0]
+    assert (revert['side'], revert['posSide'], revert['sz'], revert['reduceOnly']) == ('buy', 'short', '1.0', True)
+
+
+def test_submit_orders_keeps_open_leg_when_revert_fails(monkeypatch):
+    for order_response in ({'code': '1'}, RuntimeError('network')):
+        exchange, codes = submit_flip(monkeypatch, {'code': '2', 'data': [{'sCode': '51000'}, {'sCode': '0'}]},
+                                      order_response)
+        assert codes == ['51000', '0']
+        assert len(exchange.orders) == 1
+
+
+def test_submit_orders_both_legs_filled(monkeypatch):
+    exchange, codes = submit_flip(monkeypatch, {'code': '0', 'data': [{'sCode': '0'}, {'sCode': '0'}]})
+
+    assert codes == ['0', '0']
+    assert exchange.orders == []
+
+
+def test_submit_orders_uses_top_level_code_when_data_is_short(monkeypatch):
+    exchange, codes = submit_flip(monkeypatch, {'code': '1', 'data': [{'sCode': '51000'}]})
+
+    assert codes == ['1', '1']
+    assert exchange.orders == []